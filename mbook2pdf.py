@@ -9,7 +9,7 @@
 - 以及其他 mdBook 站点
 
 使用方法:
-    pip install requests beautifulsoup4 weasyprint
+    pip install requests aiohttp lxml "selectolax>=0.4.6" weasyprint
     python mbook2pdf.py <URL>
 
 示例:
@@ -24,42 +24,83 @@ Ubuntu 额外依赖:
 """
 
 import argparse
+import asyncio
+import functools
+import gzip
+import hashlib
 import os
 import re
 import sys
 import time
-from collections import OrderedDict
-from typing import Dict, List, Optional
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+from html import escape
+from itertools import repeat
+from typing import Dict, Iterator, List, Optional, Tuple
 from urllib.parse import urljoin, urlparse
 
+import aiohttp
+import lxml.html
 import requests
-from bs4 import BeautifulSoup
+from lxml import etree
+from requests.adapters import HTTPAdapter
+from selectolax.lexbor import LexborHTMLParser, LexborNode
+from urllib3.util.retry import Retry
 
 # 常量定义
 DEFAULT_DELAY = 0.3
 DEFAULT_TIMEOUT = 30
+DEFAULT_CONCURRENCY = 8
+DEFAULT_POOL_SIZE = 32
+CACHE_DIR_NAME = '.cache'
+# 进度条最短刷新间隔（秒），避免每个页面都写终端
+PROGRESS_INTERVAL = 0.1
+# 页面数达到该值时才使用多进程提取内容，避免进程启动开销得不偿失
+PARALLEL_EXTRACT_MIN_PAGES = 16
+PARALLEL_EXTRACT_CHUNKSIZE = 8
+DEFAULT_RETRY = Retry(
+    total=3,
+    backoff_factor=0.3,
+    status_forcelist=(500, 502, 503, 504),
+    allowed_methods=frozenset(['GET']),
+)
 DEFAULT_REQUEST_HEADERS = {
     'User-Agent': 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
     'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8',
     'Accept-Language': 'zh-CN,zh;q=0.9,en;q=0.8',
 }
 
-# CSS 选择器配置
-SIDEBAR_SELECTORS = [
-    ('nav', {'class_': 'sidebar'}),
-    ('div', {'class_': 'sidebar'}),
-    ('div', {'id': 'sidebar'}),
-    ('nav', {'class_': 'nav-chapters'}),
-    ('ol', {'class_': 'chapter'}),
-    ('ul', {'class_': 'chapter'}),
+# 页面统一按 UTF-8 解码，以字节形式交给 lxml 解析时也固定使用 UTF-8，
+# 这样带 XML 编码声明的 XHTML 页面也能解析
+SIDEBAR_HTML_PARSER = lxml.html.HTMLParser(encoding='utf-8')
+
+# XPath 配置（class 按单词精确匹配）
+_HAS_CLASS = "contains(concat(' ', normalize-space(@class), ' '), ' {} ')"
+
+# 一次求值匹配所有侧边栏候选元素，取文档中第一个
+SIDEBAR_XPATH = etree.XPath('(' + ' | '.join([
+    f"//nav[{_HAS_CLASS.format('sidebar')}]",
+    f"//div[{_HAS_CLASS.format('sidebar')}]",
+    "//div[@id='sidebar']",
+    f"//nav[{_HAS_CLASS.format('nav-chapters')}]",
+    f"//ol[{_HAS_CLASS.format('chapter')}]",
+    f"//ul[{_HAS_CLASS.format('chapter')}]",
+]) + ')[1]')
+
+BOOK_TITLE_XPATHS = [
+    etree.XPath(f"//h1[{_HAS_CLASS.format('menu-title')}]"),
+    etree.XPath(f"//a[{_HAS_CLASS.format('sidebar-logo')}]"),
 ]
+PAGE_TITLE_XPATH = etree.XPath('//title')
+LINKS_XPATH = etree.XPath('.//a[@href]')
 
+# CSS 选择器配置
 MAIN_CONTENT_SELECTORS = [
-    ('main', {}),
-    ('div', {'class_': 'content'}),
-    ('div', {'id': 'content'}),
-    ('article', {}),
-    ('div', {'class_': 'page-wrapper'}),
+    'main',
+    'div.content',
+    'div#content',
+    'article',
+    'div.page-wrapper',
 ]
 
 # 需要移除的元素配置
@@ -78,33 +119,92 @@ REMOVE_IDS = [
     'theme-toggle', 'search-toggle', 'searchbar', 'searchresults'
 ]
 
+# 合并为一个 CSS 选择器，一次遍历即可找出所有待移除元素
+REMOVE_SELECTOR = ','.join(
+    REMOVE_TAGS
+    + [f'.{c}' for c in REMOVE_CLASSES]
+    + [f'#{i}' for i in REMOVE_IDS]
+)
+
+# play 按钮、复制按钮、图标等交互元素的 class 匹配
+BUTTON_CLASS_RE = re.compile(r'(?i:play|copy)|fa-')
+
+# WeasyPrint 使用的媒体类型：HTML 内嵌的 <style> 只对 screen/print 生效，供浏览器查看和打印，
+# WeasyPrint 以该媒体类型加载时会跳过它，改用预先解析好的样式表，避免重复解析
+PDF_MEDIA_TYPE = 'weasyprint'
+
 # 文件名安全字符正则
 FILENAME_UNSAFE_CHARS = r'[<>:"/\\|?*]'
+FILENAME_UNSAFE_RE = re.compile(FILENAME_UNSAFE_CHARS)
+
+# 章节编号正则（如 "1." "1.1" "1.1.1"）
+TOC_NUMBER_RE = re.compile(r'^(\d+(?:\.\d+)*)')
+
+
+@functools.lru_cache(maxsize=4096)
+def _get_toc_level(title: str) -> int:
+    """
+    根据标题判断目录层级
+    
+    Args:
+        title: 章节标题
+        
+    Returns:
+        目录层级 (1-3)
+    """
+    # 检查是否以数字开头（如 "1. 入门" "1.1 安装" "1.1.1 详细"）
+    match = TOC_NUMBER_RE.match(title)
+    if match:
+        num_part = match.group(1)
+        dots = num_part.count('.')
+        if dots == 0:
+            return 1  # 主章节 如 "1. xxx"
+        elif dots == 1:
+            return 2  # 子章节 如 "1.1 xxx"
+        else:
+            return 3  # 更深层级
+    return 1  # 默认为主章节
 
 
 class MdBookCrawler:
     """mdBook 网站爬虫类，用于爬取并生成 PDF"""
     
-    def __init__(self, base_url: str, output_dir: Optional[str] = None, delay: float = DEFAULT_DELAY):
+    def __init__(self, base_url: str, output_dir: Optional[str] = None, delay: float = DEFAULT_DELAY,
+                 concurrency: int = DEFAULT_CONCURRENCY, use_cache: bool = True, refresh: bool = False):
         """
         初始化爬虫
         
         Args:
             base_url: mdBook 网站的基础 URL
             output_dir: 输出目录，如果为 None 则自动生成
-            delay: 请求间隔秒数
+            delay: 每个并发请求完成后的间隔秒数
+            concurrency: 同时进行的最大请求数
+            use_cache: 是否将页面缓存到输出目录的 .cache 子目录
+            refresh: 忽略已有缓存，重新下载并更新缓存
         """
         # 确保 URL 以 / 结尾
         self.base_url = base_url if base_url.endswith('/') else base_url + '/'
+        self._base_netloc = urlparse(self.base_url).netloc
         self.delay = delay
+        self.concurrency = max(1, concurrency)
+        self.use_cache = use_cache
+        self.refresh = refresh
         self.session = requests.Session()
         self.session.headers.update(DEFAULT_REQUEST_HEADERS)
         
+        # 复用连接池，并对临时性错误自动重试
+        adapter = HTTPAdapter(pool_connections=DEFAULT_POOL_SIZE, pool_maxsize=DEFAULT_POOL_SIZE,
+                              max_retries=DEFAULT_RETRY)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        
         # 从 URL 提取站点名称作为输出目录
         self.output_dir = output_dir or self._generate_output_dir(base_url)
         self.book_title: Optional[str] = None
-        self.chapters: OrderedDict[str, str] = OrderedDict()
+        self.chapters: Dict[str, str] = {}
         self.pages: List[Dict[str, str]] = []
+        self._index_html: Optional[str] = None
+        self._last_progress = 0.0
     
     @staticmethod
     def _generate_output_dir(base_url: str) -> str:
@@ -114,6 +214,44 @@ class MdBookCrawler:
         site_name = path_parts[-1] if path_parts else parsed.netloc.replace('.', '_')
         return f"./{site_name}_pdf"
     
+    def _cache_path(self, url: str) -> str:
+        """获取 URL 对应的缓存文件路径"""
+        key = hashlib.sha1(url.encode('utf-8')).hexdigest()
+        return os.path.join(self.output_dir, CACHE_DIR_NAME, f'{key}.html.gz')
+    
+    def _read_cache(self, url: str) -> Optional[str]:
+        """读取缓存的页面内容，未命中或缓存损坏时返回 None"""
+        if not self.use_cache or self.refresh:
+            return None
+        
+        cache_file = self._cache_path(url)
+        if not os.path.exists(cache_file):
+            return None
+        
+        try:
+            with gzip.open(cache_file, 'rb') as f:
+                return f.read().decode('utf-8', errors='replace')
+        except (OSError, EOFError, zlib.error):
+            # 删除损坏的缓存文件，重新下载后会写入新的缓存
+            try:
+                os.remove(cache_file)
+            except OSError:
+                pass
+            return None
+    
+    def _write_cache(self, url: str, content: bytes):
+        """将页面原始内容压缩写入缓存"""
+        if not self.use_cache:
+            return
+        
+        cache_file = self._cache_path(url)
+        try:
+            os.makedirs(os.path.dirname(cache_file), exist_ok=True)
+            with gzip.open(cache_file, 'wb') as f:
+                f.write(content)
+        except OSError as e:
+            print(f"\n  ⚠️  缓存写入失败 {url}: {e}")
+    
     def fetch_page(self, url: str) -> Optional[str]:
         """
         获取页面内容
@@ -124,42 +262,98 @@ class MdBookCrawler:
         Returns:
             页面 HTML 内容，失败返回 None
         """
+        cached = self._read_cache(url)
+        if cached is not None:
+            return cached
+        
         try:
             response = self.session.get(url, timeout=DEFAULT_TIMEOUT)
-            response.encoding = 'utf-8'
             response.raise_for_status()
-            return response.text
+            # 直接按 UTF-8 解码原始字节，跳过 response.text 的编码探测和重复缓冲
+            content = response.content
+            self._write_cache(url, content)
+            return content.decode('utf-8', errors='replace')
         except requests.RequestException as e:
             print(f"\n  ⚠️  获取失败 {url}: {e}")
             return None
     
-    def _extract_book_title(self, soup: BeautifulSoup) -> str:
+    async def _fetch_one(self, sem: asyncio.Semaphore, session: aiohttp.ClientSession,
+                         url: str) -> Tuple[str, Optional[str]]:
+        """在信号量限制下异步获取单个页面，失败时 HTML 为 None"""
+        # 首页在解析目录时已经获取过，直接复用
+        if url == self.base_url and self._index_html is not None:
+            return url, self._index_html
+        
+        # 命中缓存时无需占用并发槽位，也无需等待请求间隔
+        cached = self._read_cache(url)
+        if cached is not None:
+            return url, cached
+        
+        async with sem:
+            try:
+                async with session.get(url) as response:
+                    response.raise_for_status()
+                    content = await response.read()
+                html = content.decode('utf-8', errors='replace')
+                self._write_cache(url, content)
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                print(f"\n  ⚠️  获取失败 {url}: {e}")
+                html = None
+            
+            # 每个并发槽位保持请求间隔，避免请求过快
+            await asyncio.sleep(self.delay)
+        return url, html
+    
+    async def _fetch_all(self, urls: List[str]) -> Dict[str, Optional[str]]:
+        """
+        并发获取所有页面
+        
+        Args:
+            urls: 要获取的页面 URL 列表
+            
+        Returns:
+            URL 到 HTML 内容的映射，失败的页面值为 None
+        """
+        sem = asyncio.Semaphore(self.concurrency)
+        timeout = aiohttp.ClientTimeout(total=DEFAULT_TIMEOUT)
+        connector = aiohttp.TCPConnector(limit=self.concurrency)
+        results: Dict[str, Optional[str]] = {}
+        
+        async with aiohttp.ClientSession(headers=DEFAULT_REQUEST_HEADERS, timeout=timeout,
+                                         connector=connector) as session:
+            tasks = [asyncio.create_task(self._fetch_one(sem, session, url)) for url in urls]
+            for i, task in enumerate(asyncio.as_completed(tasks), 1):
+                url, html = await task
+                results[url] = html
+                self._display_progress(i, len(urls), self.chapters.get(url, url))
+        
+        return results
+    
+    @staticmethod
+    def _get_text(elem: lxml.html.HtmlElement) -> str:
+        """获取元素文本，去除每段文本首尾空白后拼接"""
+        return ''.join(text.strip() for text in elem.itertext())
+    
+    def _extract_book_title(self, doc: lxml.html.HtmlElement) -> str:
         """从 HTML 中提取书籍标题"""
         # 方法1: 从菜单标题或侧边栏 logo 获取
-        title_elem = soup.find('h1', class_='menu-title') or soup.find('a', class_='sidebar-logo')
-        if title_elem:
-            title = title_elem.get_text(strip=True)
-            if title:
-                return title
+        for xpath in BOOK_TITLE_XPATHS:
+            title_elems = xpath(doc)
+            if title_elems:
+                title = self._get_text(title_elems[0])
+                if title:
+                    return title
         
         # 方法2: 从页面 title 标签获取
-        title_tag = soup.find('title')
-        if title_tag:
-            title = title_tag.get_text(strip=True).split(' - ')[0].strip()
+        title_tags = PAGE_TITLE_XPATH(doc)
+        if title_tags:
+            title = self._get_text(title_tags[0]).split(' - ')[0].strip()
             if title:
                 return title
         
         # 默认标题
         return "mdBook 文档"
     
-    def _find_sidebar(self, soup: BeautifulSoup):
-        """查找侧边栏元素"""
-        for tag, attrs in SIDEBAR_SELECTORS:
-            sidebar = soup.find(tag, **attrs)
-            if sidebar:
-                return sidebar
-        return None
-    
     def _is_valid_chapter_link(self, href: str) -> bool:
         """判断是否为有效的章节链接"""
         # 跳过锚点链接
@@ -189,44 +383,44 @@ class MdBookCrawler:
         full_url = full_url.split('#')[0]
         return full_url
     
-    def _extract_chapters_from_sidebar(self, sidebar, soup: BeautifulSoup) -> OrderedDict[str, str]:
+    def _extract_chapters_from_sidebar(self, sidebar: lxml.html.HtmlElement) -> Dict[str, str]:
         """从侧边栏提取章节链接"""
-        chapters = OrderedDict()
+        chapters: Dict[str, str] = {}
         
-        for a in sidebar.find_all('a', href=True):
+        for a in LINKS_XPATH(sidebar):
             href = a.get('href', '')
             
             if not self._is_valid_chapter_link(href):
                 continue
             
-            title = a.get_text(strip=True)
+            title = self._get_text(a)
             if not title:
                 continue
             
             full_url = self._normalize_url(href)
             
             # 确保 URL 属于同一站点
-            if urlparse(full_url).netloc == urlparse(self.base_url).netloc:
+            if urlparse(full_url).netloc == self._base_netloc:
                 if full_url not in chapters:
                     chapters[full_url] = title
         
         return chapters
     
-    def _extract_chapters_from_links(self, soup: BeautifulSoup) -> OrderedDict[str, str]:
+    def _extract_chapters_from_links(self, doc: lxml.html.HtmlElement) -> Dict[str, str]:
         """从页面所有链接中提取章节（备用方法）"""
-        chapters = OrderedDict()
+        chapters: Dict[str, str] = {}
         
-        for a in soup.find_all('a', href=True):
+        for a in LINKS_XPATH(doc):
             href = a.get('href', '')
             if href.endswith('.html') and not href.startswith('http'):
                 full_url = self._normalize_url(href)
-                title = a.get_text(strip=True)
+                title = self._get_text(a)
                 if title and full_url not in chapters:
                     chapters[full_url] = title
         
         return chapters
     
-    def parse_sidebar(self, html: str) -> OrderedDict[str, str]:
+    def parse_sidebar(self, html: str) -> Dict[str, str]:
         """
         解析侧边栏获取所有章节链接
         
@@ -236,123 +430,152 @@ class MdBookCrawler:
         Returns:
             章节字典，key 为 URL，value 为标题
         """
-        soup = BeautifulSoup(html, 'html.parser')
+        try:
+            doc = lxml.html.fromstring(html.encode('utf-8'), parser=SIDEBAR_HTML_PARSER)
+        except etree.ParserError:
+            # 空白页面无法解析
+            return {}
         
         # 提取书籍标题
-        self.book_title = self._extract_book_title(soup)
+        self.book_title = self._extract_book_title(doc)
         
-        chapters = OrderedDict()
+        chapters: Dict[str, str] = {}
         
         # 方法1: 从侧边栏提取
-        sidebar = self._find_sidebar(soup)
-        if sidebar:
-            chapters = self._extract_chapters_from_sidebar(sidebar, soup)
+        sidebars = SIDEBAR_XPATH(doc)
+        if sidebars:
+            chapters = self._extract_chapters_from_sidebar(sidebars[0])
         
         # 方法2: 如果侧边栏解析失败，从页面链接中提取
         if not chapters:
-            chapters = self._extract_chapters_from_links(soup)
+            chapters = self._extract_chapters_from_links(doc)
         
         # 确保首页在列表中
         if self.base_url not in chapters:
-            chapters[self.base_url] = self.book_title
-            chapters.move_to_end(self.base_url, last=False)
+            chapters = {self.base_url: self.book_title, **chapters}
         
         return chapters
     
-    def _find_main_content(self, soup: BeautifulSoup):
+    @staticmethod
+    def _find_main_content(tree: LexborHTMLParser) -> Optional[LexborNode]:
         """查找主内容区域"""
-        for tag, attrs in MAIN_CONTENT_SELECTORS:
-            main = soup.find(tag, **attrs)
-            if main:
+        for selector in MAIN_CONTENT_SELECTORS:
+            main = tree.css_first(selector)
+            if main is not None:
                 return main
-        return soup.find('body')
+        return tree.body
     
-    def _remove_unwanted_elements(self, main):
+    @staticmethod
+    def _remove_unwanted_elements(main: LexborNode):
         """移除不需要的元素"""
-        # 移除指定标签
-        for tag in REMOVE_TAGS:
-            for elem in main.find_all(tag):
-                elem.decompose()
-        
-        # 移除指定 class 的元素
-        for class_name in REMOVE_CLASSES:
-            for elem in main.find_all(class_=class_name):
-                elem.decompose()
-        
-        # 移除指定 id 的元素
-        for id_name in REMOVE_IDS:
-            elem = main.find(id=id_name)
-            if elem:
-                elem.decompose()
+        # 移除指定标签、class 和 id 的元素
+        for node in main.css(REMOVE_SELECTOR):
+            node.decompose()
         
         # 移除 play 按钮等交互元素
-        for elem in main.find_all(['button', 'i'], class_=lambda x: x and (
-            'play' in x.lower() or 'copy' in x.lower() or 'fa-' in x
-        )):
-            elem.decompose()
+        for node in main.css('button[class], i[class]'):
+            if BUTTON_CLASS_RE.search(node.attributes.get('class') or ''):
+                node.decompose()
+    
+    @staticmethod
+    def _rename_node(node: LexborNode, tag: str):
+        """将节点替换为同属性、同内容的新标签节点（selectolax 不支持直接修改标签名）"""
+        renamed = node.parser.create_node(tag)
+        for name, value in node.attributes.items():
+            renamed.attrs[name] = value or ''
+        for child in node.iter(include_text=True):
+            renamed.insert_child(child)
+        node.replace_with(renamed)
     
-    def _process_headings(self, main):
-        """处理标题：降级并禁用书签"""
+    @staticmethod
+    def _process_elements(main: LexborNode, base_url: str):
+        """一次遍历处理标题和媒体资源：标题降级并禁用书签，修复图片和链接 URL"""
         # 移除页面原有的第一个 h1 标题（我们会在外层添加章节标题）
-        first_h1 = main.find('h1')
-        if first_h1:
+        first_h1 = main.css_first('h1')
+        if first_h1 is not None:
             first_h1.decompose()
         
-        # 将内容中的标题降级，避免与章节标题冲突，同时禁用它们的书签
-        # h1 -> h2, h2 -> h3, h3 -> h4 等
-        for i in range(5, 0, -1):  # 从 h5 到 h1
-            for h in main.find_all(f'h{i}'):
-                h.name = f'h{min(i+1, 6)}'
+        join_url = functools.partial(urljoin, base_url)
+        headings = []
+        
+        for node in main.css('h1, h2, h3, h4, h5, img, a'):
+            tag = node.tag
+            if tag == 'img':
+                # 修复图片路径
+                src = node.attributes.get('src') or ''
+                if src and not src.startswith(('http', 'data:')):
+                    node.attrs['src'] = join_url(src)
+            elif tag == 'a':
+                # 修复链接
+                href = node.attributes.get('href') or ''
+                if href and not href.startswith(('http', '#', 'mailto:', 'javascript:')):
+                    node.attrs['href'] = join_url(href)
+            else:
                 # 添加 class 禁用书签
-                existing_classes = h.get('class', [])
-                if isinstance(existing_classes, str):
-                    existing_classes = [existing_classes]
-                h['class'] = existing_classes + ['no-bookmark']
-    
-    def _fix_media_urls(self, main):
-        """修复媒体资源 URL"""
-        # 修复图片路径
-        for img in main.find_all('img'):
-            src = img.get('src', '')
-            if src and not src.startswith(('http', 'data:')):
-                img['src'] = urljoin(self.base_url, src)
-        
-        # 修复链接
-        for a in main.find_all('a'):
-            href = a.get('href', '')
-            if href and not href.startswith(('http', '#', 'mailto:', 'javascript:')):
-                a['href'] = urljoin(self.base_url, href)
+                existing_classes = node.attributes.get('class')
+                node.attrs['class'] = f'{existing_classes} no-bookmark' if existing_classes else 'no-bookmark'
+                headings.append(node)
+        
+        # 将内容中的标题降级，避免与章节标题冲突：h1 -> h2, h2 -> h3 等
+        # 替换节点会复制其子节点，因此放在标题内链接修复完成之后进行
+        for h in headings:
+            MdBookCrawler._rename_node(h, f'h{int(h.tag[1]) + 1}')
     
-    def extract_content(self, html: str) -> str:
+    @staticmethod
+    def extract_content(html: str, base_url: str) -> str:
         """
-        提取页面主要内容
+        提取页面主要内容（静态方法，可在子进程中执行）
         
         Args:
             html: 页面 HTML 内容
+            base_url: 用于补全相对链接的基础 URL
             
         Returns:
             提取后的 HTML 内容
         """
-        soup = BeautifulSoup(html, 'html.parser')
-        main = self._find_main_content(soup)
+        tree = LexborHTMLParser(html)
+        main = MdBookCrawler._find_main_content(tree)
         
-        if not main:
+        if main is None:
             return ""
         
         # 清理内容
-        self._remove_unwanted_elements(main)
-        self._process_headings(main)
-        self._fix_media_urls(main)
+        MdBookCrawler._remove_unwanted_elements(main)
+        MdBookCrawler._process_elements(main, base_url)
+        
+        return main.html
+    
+    def _extract_all(self, htmls: List[str]) -> List[str]:
+        """
+        提取所有页面的主要内容，页面较多时分发到多个进程并行处理
+        
+        Args:
+            htmls: 页面 HTML 内容列表
+            
+        Returns:
+            与输入顺序一致的提取结果列表
+        """
+        if len(htmls) < PARALLEL_EXTRACT_MIN_PAGES:
+            return [self.extract_content(html, self.base_url) for html in htmls]
         
-        return str(main)
+        with ProcessPoolExecutor(max_workers=os.cpu_count()) as executor:
+            return list(executor.map(self.extract_content, htmls, repeat(self.base_url),
+                                     chunksize=PARALLEL_EXTRACT_CHUNKSIZE))
     
     def _display_progress(self, current: int, total: int, title: str):
-        """显示爬取进度"""
+        """显示爬取进度（限制刷新频率，最后一次总会显示）"""
+        # 只在事件循环线程中调用，无需加锁
+        now = time.monotonic()
+        if current != total and now - self._last_progress < PROGRESS_INTERVAL:
+            return
+        self._last_progress = now
+        
         progress_bar_length = 30
         filled = current * progress_bar_length // total
         progress = "█" * filled + "░" * (progress_bar_length - filled)
         display_title = title[:35] if len(title) <= 35 else title[:32] + "..."
-        print(f"\r  [{progress}] {current}/{total} {display_title:<35}", end="", flush=True)
+        sys.stdout.write(f"\r  [{progress}] {current}/{total} {display_title:<35}")
+        sys.stdout.flush()
     
     def crawl(self) -> bool:
         """
@@ -367,6 +590,7 @@ class MdBookCrawler:
         if not index_html:
             print("❌ 无法获取首页")
             return False
+        self._index_html = index_html
         
         print("📋 正在解析目录结构...")
         self.chapters = self.parse_sidebar(index_html)
@@ -378,53 +602,28 @@ class MdBookCrawler:
         print(f"✅ 找到 {len(self.chapters)} 个页面")
         print(f"📚 书籍标题: {self.book_title}\n")
         
-        pages = []
-        total = len(self.chapters)
+        htmls = asyncio.run(self._fetch_all(list(self.chapters)))
+        print()  # 换行
         
-        for i, (url, title) in enumerate(self.chapters.items(), 1):
-            self._display_progress(i, total, title)
-            
-            html = self.fetch_page(url)
-            if html:
-                content = self.extract_content(html)
-                pages.append({
-                    'url': url,
-                    'title': title,
-                    'content': content
-                })
-            
-            time.sleep(self.delay)
+        # 按目录顺序提取内容
+        fetched = [(url, title, htmls[url]) for url, title in self.chapters.items() if htmls.get(url)]
+        if fetched:
+            print("🧹 正在提取页面内容...")
+        contents = self._extract_all([html for _, _, html in fetched])
+        
+        pages = []
+        for (url, title, _), content in zip(fetched, contents):
+            pages.append({
+                'url': url,
+                'title': title,
+                'content': content
+            })
         
-        print()  # 换行
         print(f"\n✅ 成功爬取 {len(pages)} 个页面")
         
         self.pages = pages
         return True
     
-    @staticmethod
-    def _get_toc_level(title: str) -> int:
-        """
-        根据标题判断目录层级
-        
-        Args:
-            title: 章节标题
-            
-        Returns:
-            目录层级 (1-3)
-        """
-        # 检查是否以数字开头（如 "1. 入门" "1.1 安装" "1.1.1 详细"）
-        match = re.match(r'^(\d+(?:\.\d+)*)', title)
-        if match:
-            num_part = match.group(1)
-            dots = num_part.count('.')
-            if dots == 0:
-                return 1  # 主章节 如 "1. xxx"
-            elif dots == 1:
-                return 2  # 子章节 如 "1.1 xxx"
-            else:
-                return 3  # 更深层级
-        return 1  # 默认为主章节
-    
     @staticmethod
     def _get_css_styles() -> str:
         """获取 CSS 样式"""
@@ -608,7 +807,6 @@ class MdBookCrawler:
             line-height: 1.45;
             page-break-inside: avoid;
             white-space: pre-wrap;
-            word-wrap: break-word;
             margin: 1em 0;
         }
         
@@ -619,6 +817,11 @@ class MdBookCrawler:
             font-size: inherit;
         }
         
+        /* 逐字符断行会让 WeasyPrint 逐字计算最小宽度，代码块很多时极慢，仅在显式需要时启用 */
+        pre code.wrap {
+            word-wrap: break-word;
+        }
+        
         /* 章节分隔 */
         .chapter {
             page-break-before: always;
@@ -647,12 +850,17 @@ class MdBookCrawler:
         /* 表格 */
         table {
             border-collapse: collapse;
+            table-layout: fixed;
             width: 100%;
             margin: 1em 0;
-            page-break-inside: avoid;
             font-size: 10pt;
         }
         
+        /* 长表格整体避免分页会导致反复重排，只避免在行内分页 */
+        tr {
+            page-break-inside: avoid;
+        }
+        
         th, td {
             border: 1px solid #bdc3c7;
             padding: 8px 10px;
@@ -702,53 +910,45 @@ class MdBookCrawler:
             bookmark-level: none;
         }'''
     
-    def _generate_toc_html(self) -> str:
-        """生成目录 HTML"""
-        items = list(self.chapters.items())
-        mid = (len(items) + 1) // 2
-        
-        toc_html = '        <td>\n'
-        for url, title in items[:mid]:
-            level = self._get_toc_level(title)
-            toc_html += f'            <div class="toc-item level-{level}">{title}</div>\n'
-        toc_html += '        </td>\n'
-        
-        toc_html += '        <td>\n'
-        for url, title in items[mid:]:
-            level = self._get_toc_level(title)
-            toc_html += f'            <div class="toc-item level-{level}">{title}</div>\n'
-        toc_html += '        </td>\n'
-        
-        return toc_html
+    def _generate_toc_html(self) -> Iterator[str]:
+        """逐行生成目录 HTML（分为左右两列）"""
+        titles = list(self.chapters.values())
+        mid = (len(titles) + 1) // 2
+        
+        for column in (titles[:mid], titles[mid:]):
+            yield '        <td>\n'
+            for title in column:
+                yield f'            <div class="toc-item level-{_get_toc_level(title)}">{escape(title)}</div>\n'
+            yield '        </td>\n'
     
-    def _generate_chapters_html(self) -> str:
-        """生成章节内容 HTML"""
-        chapters_html = ''
+    def _generate_chapters_html(self) -> Iterator[str]:
+        """逐章生成章节内容 HTML"""
         for i, page in enumerate(self.pages):
-            level = self._get_toc_level(page['title'])
+            level = _get_toc_level(page['title'])
             heading_tag = f'h{min(level, 3)}'
             
-            chapters_html += f'''
+            yield f'''
 <div class="chapter" id="chapter-{i}">
-<{heading_tag} class="chapter-title bookmark-{level}">{page['title']}</{heading_tag}>
+<{heading_tag} class="chapter-title bookmark-{level}">{escape(page['title'])}</{heading_tag}>
 {page['content']}
 </div>
 '''
-        return chapters_html
     
-    def generate_html(self) -> str:
+    def generate_html(self) -> Iterator[str]:
         """
-        生成合并的 HTML 文件
+        分段生成合并的 HTML 文件，避免在内存中拼接整个文档
         
         Returns:
-            完整的 HTML 内容
+            依次产出 HTML 片段的迭代器
         """
-        html = f'''<!DOCTYPE html>
+        book_title = escape(self.book_title)
+        base_url = escape(self.base_url)
+        yield f'''<!DOCTYPE html>
 <html lang="zh-CN">
 <head>
     <meta charset="UTF-8">
-    <title>{self.book_title}</title>
-    <style>
+    <title>{book_title}</title>
+    <style media="screen, print">
 {self._get_css_styles()}
     </style>
 </head>
@@ -757,9 +957,9 @@ class MdBookCrawler:
 <!-- 封面 -->
 <div class="cover">
     <div class="logo">🦀</div>
-    <h1>{self.book_title}</h1>
+    <h1>{book_title}</h1>
     <p class="source">
-        来源：<a href="{self.base_url}">{self.base_url}</a>
+        来源：<a href="{base_url}">{base_url}</a>
     </p>
 </div>
 
@@ -767,20 +967,22 @@ class MdBookCrawler:
 <div class="toc">
     <h1>目 录</h1>
     <table class="toc-table"><tr>
-{self._generate_toc_html()}    </tr></table>
+'''
+        yield from self._generate_toc_html()
+        yield '''    </tr></table>
 </div>
 
-{self._generate_chapters_html()}
+'''
+        yield from self._generate_chapters_html()
+        yield '''
 </body>
 </html>
 '''
-        
-        return html
     
     @staticmethod
     def _sanitize_filename(title: str) -> str:
         """生成安全的文件名"""
-        return re.sub(FILENAME_UNSAFE_CHARS, '_', title)
+        return FILENAME_UNSAFE_RE.sub('_', title)
     
     def save_html(self) -> str:
         """
@@ -791,12 +993,12 @@ class MdBookCrawler:
         """
         os.makedirs(self.output_dir, exist_ok=True)
         
-        html_content = self.generate_html()
         safe_title = self._sanitize_filename(self.book_title)
         html_file = os.path.join(self.output_dir, f'{safe_title}.html')
         
+        # 逐段写入文件，内存占用只与单个章节大小相关
         with open(html_file, 'w', encoding='utf-8') as f:
-            f.write(html_content)
+            f.writelines(self.generate_html())
         
         print(f"✅ HTML 文件已保存: {html_file}")
         return html_file
@@ -812,7 +1014,7 @@ class MdBookCrawler:
             PDF 文件路径，失败返回 None
         """
         try:
-            from weasyprint import HTML
+            from weasyprint import CSS, HTML
             from weasyprint.text.fonts import FontConfiguration
         except ImportError:
             print("\n❌ WeasyPrint 未安装")
@@ -828,8 +1030,10 @@ class MdBookCrawler:
             safe_title = self._sanitize_filename(self.book_title)
             pdf_file = os.path.join(self.output_dir, f'{safe_title}.pdf')
             
-            html = HTML(filename=html_file)
-            html.write_pdf(pdf_file, font_config=font_config)
+            # 样式表只解析一次，并与渲染共用同一个字体配置
+            css = CSS(string=self._get_css_styles(), font_config=font_config)
+            html = HTML(filename=html_file, media_type=PDF_MEDIA_TYPE)
+            html.write_pdf(pdf_file, stylesheets=[css], font_config=font_config)
             
             # 获取文件大小
             size_mb = os.path.getsize(pdf_file) / (1024 * 1024)
@@ -891,6 +1095,12 @@ def main():
     parser.add_argument('-o', '--output', help='输出目录 (默认: 根据 URL 自动生成)')
     parser.add_argument('-d', '--delay', type=float, default=DEFAULT_DELAY, 
                         help=f'请求间隔秒数 (默认: {DEFAULT_DELAY})')
+    parser.add_argument('-c', '--concurrency', type=int, default=DEFAULT_CONCURRENCY,
+                        help=f'并发请求数 (默认: {DEFAULT_CONCURRENCY})')
+    parser.add_argument('--no-cache', action='store_true',
+                        help='不读取也不写入页面缓存')
+    parser.add_argument('--refresh', action='store_true',
+                        help='忽略已有页面缓存，重新下载并更新缓存')
     parser.add_argument('--html-only', action='store_true',
                         help='只生成 HTML，不转换 PDF')
     
@@ -898,7 +1108,8 @@ def main():
     
     _print_header()
     
-    crawler = MdBookCrawler(args.url, args.output, args.delay)
+    crawler = MdBookCrawler(args.url, args.output, args.delay, args.concurrency,
+                            use_cache=not args.no_cache, refresh=args.refresh)
     
     if not crawler.crawl():
         sys.exit(1)